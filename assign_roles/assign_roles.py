@@ -13,7 +13,10 @@ class AssignRoles:
     DATA_FOLDER = "data/assign_roles"
     CONFIG_FILE_PATH = DATA_FOLDER + "/config.json"
 
+    SAVE_DELAY = 2  # Seconds, role authorization changes made meanwhile are written together
+
     CONFIG_DEFAULT = {}  # Structure: {server.id: {giveable_role: [authorized_roles]}}
+    # In memory, the [authorized_roles] lists are kept as sets for fast membership tests
 
     ASSIGN_ADDED = ":white_check_mark: Successfully assigned the `{}` role."
     ASSIGN_REMOVED = ":put_litter_in_its_place: Successfully removed the `{}` role."
@@ -31,10 +34,14 @@ class AssignRoles:
 
     def __init__(self, bot: discord.Client):
         self.bot = bot
+        self.save_handle = None
         self.check_configs()
         self.load_data()
 
     # Events
+    def __unload(self):
+        if self.save_handle is not None:
+            self.flush_data()
 
     # Commands
     @commands.group(name="assign", pass_context=True, invoke_without_command=True, no_pm=True)
@@ -52,10 +59,10 @@ class AssignRoles:
         elif role_id not in server_dict:  # No role authorized to give this role.
             notice = self.AUTHORIZE_EMPTY.format(role.name)
         # Check if any of the author's roles is authorized to grant the role.
-        elif not any(r.id in server_dict[role_id] for r in author.roles):
+        elif server_dict[role_id].isdisjoint(r.id for r in author.roles):
             notice = self.AUTHORIZE_MISMATCH.format(author.mention, role.name)
         else:  # Role "transaction" is valid.
-            if role in user.roles:
+            if role_id in {r.id for r in user.roles}:  # Compares ids instead of going through Role.__eq__
                 await self.bot.remove_roles(user, role)
                 notice = self.ASSIGN_REMOVED.format(role.name)
             else:
@@ -73,19 +80,18 @@ class AssignRoles:
         msg = ctx.message
         server_dict = self.config.setdefault(msg.server.id, {})
 
-        author_max_role = max(r for r in msg.author.roles)
         authorized_id = authorized_role.id
         giveable_id = giveable_role.id
 
         if authorized_role.is_everyone:  # Role to be authorized should not be @everyone.
             notice = self.AUTHORIZE_NO_EVERYONE
-        elif authorized_role >= author_max_role:  # Hierarchical role order check.
+        elif authorized_role >= max(msg.author.roles):  # Hierarchical role order check.
             notice = self.AUTHORIZE_NO_HIGHER
         # Check if "pair" already exists.
         elif giveable_id in server_dict and authorized_id in server_dict[giveable_id]:
             notice = self.AUTHORIZE_EXISTS
         else:  # Role authorization is valid.
-            server_dict.setdefault(giveable_id, []).append(authorized_id)
+            server_dict.setdefault(giveable_id, set()).add(authorized_id)
             self.save_data()
             notice = self.AUTHORIZE_SUCCESS.format(authorized_role.name, giveable_role.name)
         await self.bot.send_message(msg.channel, notice)
@@ -99,20 +105,19 @@ class AssignRoles:
         msg = ctx.message
         server_dict = self.config.setdefault(msg.server.id, {})
 
-        author_max_role = max(r for r in msg.author.roles)
         authorized_id = authorized_role.id
         giveable_id = giveable_role.id
 
         if authorized_role.is_everyone:  # Role to be de-authorized should not be @everyone.
             notice = self.AUTHORIZE_NO_EVERYONE
-        elif authorized_role >= author_max_role:  # Hierarchical role order check.
+        elif authorized_role >= max(msg.author.roles):  # Hierarchical role order check.
             notice = self.AUTHORIZE_NO_HIGHER
         elif giveable_id not in server_dict:
             notice = self.AUTHORIZE_EMPTY.format(giveable_role.name)
         elif authorized_id not in server_dict[giveable_id]:
             notice = self.AUTHORIZE_MISMATCH.format(authorized_role.name, giveable_role.name)
         else:  # Role de-authorization is valid.
-            server_dict[giveable_id].remove(authorized_id)
+            server_dict[giveable_id].discard(authorized_id)
             self.save_data()
             notice = self.DEAUTHORIZE_SUCCESS.format(authorized_role.name, giveable_role.name)
         await self.bot.send_message(msg.channel, notice)
@@ -125,11 +130,12 @@ class AssignRoles:
         srv = msg.server
         server_dict = self.config.setdefault(srv.id, {})
         embed = discord.Embed(colour=0x00D8FF, title="Assign authorizations")
+        get_role = {r.id: r for r in srv.roles}.get
 
         for role_id, auth_list in server_dict.items():
-            role = discord.utils.get(srv.roles, id=role_id)
+            role = get_role(role_id)
             if role is not None:
-                auth_roles = (discord.utils.get(srv.roles, id=i) for i in auth_list)
+                auth_roles = (get_role(i) for i in auth_list)
                 mentions_str = ", ".join(r.mention for r in auth_roles if r is not None)
                 if len(mentions_str) > 0:  # Prevent empty fields from being sent.
                     embed.add_field(name=role.name, value=mentions_str)
@@ -154,10 +160,21 @@ class AssignRoles:
             dataIO.save_json(file, default)
 
     def load_data(self):
-        self.config = dataIO.load_json(self.CONFIG_FILE_PATH)
+        config = dataIO.load_json(self.CONFIG_FILE_PATH)
+        self.config = {server_id: {role_id: set(auth_list) for role_id, auth_list in server_dict.items()}
+                       for server_id, server_dict in config.items()}
 
     def save_data(self):
-        dataIO.save_json(self.CONFIG_FILE_PATH, self.config)
+        if self.save_handle is None:
+            self.save_handle = self.bot.loop.call_later(self.SAVE_DELAY, self.flush_data)
+
+    def flush_data(self):
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
+        config = {server_id: {role_id: list(auth_set) for role_id, auth_set in server_dict.items()}
+                  for server_id, server_dict in self.config.items()}
+        dataIO.save_json(self.CONFIG_FILE_PATH, config)
 
 
 def setup(bot):
@@ -17,15 +17,21 @@ class Birthdays:
     # File related constants
     DATA_FOLDER = "data/birthdays"
     CONFIG_FILE_PATH = DATA_FOLDER + "/config.json"
+    SAVE_DELAY = 2  # Seconds between the first unsaved change and the config write
+    CLEAN_CONCURRENCY = 5  # Maximum amount of users whose birthday role is being removed at the same time
 
     # Configuration default
     CONFIG_DEFAULT = {
         "roles": {},  # {server.id: role.id} of the birthday roles
         "channels": {},  # {server.id: channel.id} of the birthday announcement channels
-        "birthdays": {},  # {date: {user.id: year}} of the users' birthdays
+        "birthdays": {},  # {date: {user.id: year}} of the users' birthdays (date is an ordinal, int in memory)
         "yesterday": []  # List of user ids who's birthday was done yesterday
     }
 
+    # Display constants
+    MONTH_NAMES = [datetime.date(1, m, 1).strftime("%B") for m in range(1, 13)]
+    DAY_STRS = [str(d) for d in range(1, 32)]  # Days without the leading zero
+
     # Message constants
     ROLE_SET = ":white_check_mark: The birthday role on **{s}** has been set to: **{r}**."
     BDAY_INVALID = ":x: The birthday date you entered is invalid. It must be `MM-DD`."
@@ -35,6 +41,8 @@ class Birthdays:
 
     def __init__(self, bot: discord.Client):
         self.bot = bot
+        self.save_handle = None
+        self.role_cache = {}  # {server.id: {role.id: role}} filled lazily and dropped when the roles change
         self.check_configs()
         self.load_data()
         self.bday_loop = asyncio.ensure_future(self.initialise())  # Starts a loop which checks daily for birthdays
@@ -53,6 +61,17 @@ class Birthdays:
 
     def __unload(self):
         self.bday_loop.cancel()  # Forcefully cancel the loop when unloaded
+        if self.save_handle is not None:
+            self.flush_data()
+
+    async def on_server_role_create(self, role):
+        self.role_cache.pop(role.server.id, None)
+
+    async def on_server_role_delete(self, role):
+        self.role_cache.pop(role.server.id, None)
+
+    async def on_server_role_update(self, before, after):
+        self.role_cache.pop(after.server.id, None)
 
     # Commands
     @commands.group(pass_context=True, invoke_without_command=True)
@@ -106,10 +125,12 @@ class Birthdays:
             await self.bot.send_message(channel, self.BDAY_INVALID)
         else:
             self.remove_user_bday(author.id)
-            self.config["birthdays"].setdefault(str(birthday.toordinal()), {})[author.id] = year
+            date = birthday.toordinal()
+            self.config["birthdays"].setdefault(date, {})[author.id] = year
+            self.user_dates[author.id] = date
             self.save_data()
-            bday_month_str = birthday.strftime("%B")
-            bday_day_str = birthday.strftime("%d").lstrip("0")  # To remove the zero-capped
+            bday_month_str = self.MONTH_NAMES[birthday.month - 1]
+            bday_day_str = str(birthday.day)
             await self.bot.send_message(channel, self.BDAY_SET.format(bday_month_str + " " + bday_day_str))
 
     @bday.command(name="list", pass_context=True)
@@ -124,29 +145,32 @@ class Birthdays:
         bdays = self.config["birthdays"]
         this_year = datetime.date.today().year
         embed = discord.Embed(title="Birthday List", color=discord.Colour.lighter_grey())
-        for k, g in itertools.groupby(sorted(datetime.datetime.fromordinal(int(o)) for o in bdays.keys()),
-                                      lambda i: i.month):
+        # Ordinals sort chronologically, so the dates only need to be built once for display
+        fromordinal = datetime.date.fromordinal
+        dates = ((fromordinal(o), users) for o, users in sorted(bdays.items()))
+        for k, g in itertools.groupby(dates, lambda i: i[0].month):
             # Basically separates days with "\n" and people on the same day with ", "
-            value = "\n".join(date.strftime("%d").lstrip("0") + ": "
+            value = "\n".join(self.DAY_STRS[date.day - 1] + ": "
                               + ", ".join("<@!{}>".format(u_id)
                                           + ("" if year is None else " ({})".format(this_year - int(year)))
-                                          for u_id, year in bdays.get(str(date.toordinal()), {}).items())
-                              for date in g if len(bdays.get(str(date.toordinal()))) > 0)
+                                          for u_id, year in users.items())
+                              for date, users in g if len(users) > 0)
             if not value.isspace():  # Only contains whitespace when there's no birthdays in that month
-                embed.add_field(name=datetime.datetime(year=1, month=k, day=1).strftime("%B"), value=value)
+                embed.add_field(name=self.MONTH_NAMES[k - 1], value=value)
         await self.bot.send_message(channel, embed=embed)
 
     # Utilities
     async def clean_bday(self, user_id):
+        removals = []
         for server_id, role_id in self.config["roles"].items():
             server = self.bot.get_server(server_id)
             if server is not None:
-                role = discord.utils.find(lambda r: r.id == role_id, server.roles)
-                # If discord.Server.roles was an OrderedDict instead...
+                role = self.get_role(server, role_id)
                 member = server.get_member(user_id)
                 if member is not None and role is not None and role in member.roles:
                     # If the user and the role are still on the server and the user has the bday role
-                    await self.bot.remove_roles(member, role)
+                    removals.append(self.bot.remove_roles(member, role))
+        await asyncio.gather(*removals)
 
     async def handle_bday(self, user_id, year):
         embed = discord.Embed(color=discord.Colour.gold())
@@ -155,14 +179,16 @@ class Birthdays:
             embed.description = "<@!{}> is now **{} years old**. :tada:".format(user_id, age)
         else:
             embed.description = "It's <@!{}>'s birthday today! :tada:".format(user_id)
+        get_server = self.bot.get_server
+        roles = self.config["roles"]
         for server_id, channel_id in self.config["channels"].items():
-            server = self.bot.get_server(server_id)
+            server = get_server(server_id)
             if server is not None:  # Ignore unavailable servers or servers the bot isn't in anymore
                 member = server.get_member(user_id)
                 if member is not None:
-                    role_id = self.config["roles"].get(server_id)
+                    role_id = roles.get(server_id)
                     if role_id is not None:
-                        role = discord.utils.find(lambda r: r.id == role_id, server.roles)
+                        role = self.get_role(server, role_id)
                         if role is not None:
                             try:
                                 await self.bot.add_roles(member, role)
@@ -180,33 +206,51 @@ class Birthdays:
 
         Happens when someone changes their birthday and there's nobody else in the same day"""
         birthdays = self.config["birthdays"]
+        known_users = {m.id for m in self.bot.get_all_members()}
         for date, bdays in birthdays.copy().items():
             for user_id, year in bdays.copy().items():
-                if not any(s.get_member(user_id) is not None for s in self.bot.servers):
+                if user_id not in known_users:
                     del birthdays[date][user_id]
+                    self.user_dates.pop(user_id, None)
             if len(bdays) == 0:
                 del birthdays[date]
 
+    def get_role(self, server, role_id):
+        roles = self.role_cache.get(server.id)
+        if roles is None:
+            roles = self.role_cache[server.id] = {r.id: r for r in server.roles}
+        return roles.get(role_id)
+
     def remove_user_bday(self, user_id):
-        for date, user_ids in self.config["birthdays"].items():
-            if user_id in user_ids:
-                del self.config["birthdays"][date][user_id]
+        date = self.user_dates.pop(user_id, None)
+        if date is not None:
+            bdays = self.config["birthdays"].get(date, {})
+            bdays.pop(user_id, None)
+            if len(bdays) == 0:
+                self.config["birthdays"].pop(date, None)
         # Won't prevent the cleaning problem here cause the users can leave so we'd still want to clean anyway
 
     def clean_yesterday_bdays(self):
-        for user_id in self.config["yesterday"]:
-            asyncio.ensure_future(self.clean_bday(user_id))
-        self.config["yesterday"].clear()
+        yesterday = self.config["yesterday"]
+        if len(yesterday) > 0:
+            semaphore = asyncio.Semaphore(self.CLEAN_CONCURRENCY)
+
+            async def clean_one(user_id):
+                async with semaphore:
+                    await self.clean_bday(user_id)
+            asyncio.ensure_future(asyncio.gather(*(clean_one(user_id) for user_id in yesterday)))
+        yesterday.clear()
 
     def do_today_bdays(self):
         this_date = datetime.datetime.utcnow().date().replace(year=1)
-        for user_id, year in self.config["birthdays"].get(str(this_date.toordinal()), {}).items():
+        for user_id, year in self.config["birthdays"].get(this_date.toordinal(), {}).items():
             asyncio.ensure_future(self.handle_bday(user_id, year))
 
     def parse_date(self, date_str):
         result = None
         try:
-            result = datetime.datetime.strptime(date_str, "%m-%d").date().replace(year=1)
+            month, day = date_str.split("-")
+            result = datetime.date(1, int(month), int(day))  # Validates the date like strptime would
         except ValueError:
             pass
         return result
@@ -231,9 +275,21 @@ class Birthdays:
 
     def load_data(self):
         self.config = dataIO.load_json(self.CONFIG_FILE_PATH)
+        self.config["birthdays"] = {int(date): bdays for date, bdays in self.config["birthdays"].items()}
+        # Reverse index of {user.id: date} to find a user's birthday without going through every date
+        self.user_dates = {user_id: date for date, bdays in self.config["birthdays"].items() for user_id in bdays}
 
     def save_data(self):
-        dataIO.save_json(self.CONFIG_FILE_PATH, self.config)
+        if self.save_handle is None:
+            self.save_handle = self.bot.loop.call_later(self.SAVE_DELAY, self.flush_data)
+
+    def flush_data(self):
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
+        # JSON only supports string keys
+        birthdays = {str(date): bdays for date, bdays in self.config["birthdays"].items()}
+        dataIO.save_json(self.CONFIG_FILE_PATH, dict(self.config, birthdays=birthdays))
 
 
 def setup(bot):
@@ -28,6 +28,8 @@ class ClientModification:
 
     Changes like these are in this centralized cog to prevent conflicts when monkey patching.
         Basically to ensure `revert_modifications` doesn't remove another monkey patch which might've been done later"""
+
+    __slots__ = ("bot", "cached_messages", "__og_get_message")
     
     def __init__(self, bot):
         self.bot = bot
@@ -45,7 +47,10 @@ class ClientModification:
 
     # Endpoints
     def add_cached_messages(self, messages):
-        self.cached_messages.update((m.id, m) for m in messages if isinstance(m, discord.Message))
+        try:  # Batches are normally only made of messages so they're not type checked unless something's off
+            self.cached_messages.update((m.id, m) for m in messages)
+        except AttributeError:
+            self.cached_messages.update((m.id, m) for m in messages if isinstance(m, discord.Message))
     
     def add_cached_message(self, message):
         if isinstance(message, discord.Message):
@@ -53,22 +58,20 @@ class ClientModification:
     
     def remove_cached_message(self, message):
         if isinstance(message, discord.Message):
-            if message.id in self.cached_messages:
-                del self.cached_messages[message.id]
+            self.cached_messages.pop(message.id, None)
         elif isinstance(message, str):
-            if message in self.cached_messages:
-                del self.cached_messages[message]
+            self.cached_messages.pop(message, None)
     
     # Utilities
     def _init_message_modifs(self):
+        # Bound once here since this is called for every message related event
+        cached_messages = self.cached_messages
+        og_get_message = self.bot.connection._get_message
+
         def _get_modified_message(message_id):
-            message = None
-            cm = self.bot.get_cog("ClientModification")
-            # Checking if ClientModification is still loaded in case it was unloaded without reverting this
-            if cm is not None:
-                message = cm.cached_messages.get(message_id)
-            return message or self.__og_get_message(message_id)
-        self.__og_get_message = self.bot.connection._get_message
+            # discord.py's own cache answers most lookups so it's checked first
+            return og_get_message(message_id) or cached_messages.get(message_id)
+        self.__og_get_message = og_get_message
         self.bot.connection._get_message = _get_modified_message
     
     def revert_modifications(self):
@@ -4,7 +4,7 @@ import os.path
 import os
 import logging
 import re
-import contextlib
+import itertools
 
 from typing import List
 
@@ -13,18 +13,24 @@ from discord.ext.commands.context import Context
 from .utils.dataIO import dataIO
 from .utils import checks
 
+# Module level so the per-message checks don't go through the class' attributes
+EMOTE_REGEX = re.compile("<a?:[a-zA-Z0-9_]{2,32}:(\d{1,20})>")
+URL_REGEX = re.compile("<?(https?|ftp)://[^\s/$.?#].[^\s]*>?")
+
 
 class EmbedReactor:
     """Reacts to embeds in specific channels"""
 
+    __slots__ = ("bot", "logger", "save_handle", "config", "emote_cache", "emote_ids", "preprocessed_config",
+                 "configured_channels")
+
     DATA_FOLDER = "data/embed_reactor"
     CONFIG_FILE_PATH = DATA_FOLDER + "/config.json"
+    SAVE_DELAY = 2  # Seconds
 
     CONFIG_DEFAULT = {}
 
     REACTION_CAP = 20
-    EMOTE_REGEX = re.compile("<a?:[a-zA-Z0-9_]{2,32}:(\d{1,20})>")
-    URL_REGEX = re.compile("<?(https?|ftp)://[^\s/$.?#].[^\s]*>?")
 
     REMOVED_CHANNEL_REACTOR = ":put_litter_in_its_place: Successfully removed the reactor from {}."
     INVALID_EMOTES = ":x: The following emotes are invalid: {}."
@@ -37,32 +43,35 @@ class EmbedReactor:
     def __init__(self, bot: discord.Client):
         self.bot = bot
         self.logger = logging.getLogger("red.ZeCogs.embed_reactor")
+        self.save_handle = None
         self.check_configs()
         self.load_data()
         self.emote_cache = {}
+        self.emote_ids = {}  # {emote: emote_id} memoized results of parsing the emotes with EMOTE_REGEX
         self.preprocessed_config = {}
+        self.configured_channels = frozenset()  # Keys of preprocessed_config to quickly ignore other channels
         asyncio.ensure_future(self.initialize())
 
     # Events
     async def initialize(self):
         await self.bot.wait_until_ready()
-        for server in self.bot.servers:
-            for emote in server.emojis:
-                self.emote_cache[emote.id] = emote
+        self.emote_cache = {e.id: e for e in itertools.chain.from_iterable(s.emojis for s in self.bot.servers)}
 
         for channel_id, reactions in self.config.items():
-            channel_cache = self.preprocessed_config.setdefault(channel_id, [])
-            for reaction in reactions:
-                channel_cache.append(self.find_emote(reaction) or reaction)
+            self.preprocessed_config[channel_id] = tuple(self.find_emote(r) or r for r in reactions)
+        self.configured_channels = frozenset(self.preprocessed_config)
+
+    def __unload(self):
+        if self.save_handle is not None:
+            self.flush_data()
 
     async def on_message(self, message: discord.Message):
+        if message.channel.id not in self.configured_channels:
+            return
         reactions = self.preprocessed_config.get(message.channel.id)
-        if reactions is not None:
-            match = self.URL_REGEX.search(message.content)
-            if len(message.attachments) > 0 or (match and not match.group(0).startswith("<") and not match.group(0).endswith(">")):
-                for reaction in reactions:
-                    with contextlib.suppress(Exception):
-                        await self.bot.add_reaction(message, reaction)
+        if reactions is not None and self.should_react(message):
+            # Failing reactions are ignored; the order they end up in isn't guaranteed
+            await asyncio.gather(*(self.bot.add_reaction(message, r) for r in reactions), return_exceptions=True)
 
     async def on_server_emojis_update(self, before: List[discord.Emoji], after: List[discord.Emoji]):
         after = {e.id: e for e in after}
@@ -96,6 +105,7 @@ class EmbedReactor:
             self.config.pop(channel.id, None)
             self.save_data()
             self.preprocessed_config.pop(channel.id, None)
+            self.configured_channels = frozenset(self.preprocessed_config)
             response = self.REMOVED_CHANNEL_REACTOR.format(channel.mention)
         elif channel.server is None:
             response = self.MUST_BE_SERVER_CHANNEL
@@ -109,15 +119,27 @@ class EmbedReactor:
         else:
             self.config[channel.id] = reactions
             self.save_data()
-            self.preprocessed_config[channel.id] = [self.find_emote(emote) or emote for emote in reactions]
+            self.preprocessed_config[channel.id] = tuple(self.find_emote(emote) or emote for emote in reactions)
+            self.configured_channels = frozenset(self.preprocessed_config)
             response = self.SET_CHANNEL_REACTOR.format(channel.mention, ", ".join(reactions))
         await self.bot.send_message(message.channel, response)
 
     # Utilities
+    def should_react(self, message: discord.Message) -> bool:
+        """Whether the message has an attachment or a URL which will be embedded"""
+        if len(message.attachments) > 0:
+            result = True
+        elif "://" in message.content:  # Avoids running the regex on messages which can't contain a URL
+            match = URL_REGEX.search(message.content)
+            # <url> doesn't embed
+            result = match is not None and not match.group(0).startswith("<") and not match.group(0).endswith(">")
+        else:
+            result = False
+        return result
+
     async def is_valid_emote(self, emote: str, message: discord.Message) -> bool:
-        emote_match = self.EMOTE_REGEX.fullmatch(emote)
-        emote_id = emote if emote_match is None else emote_match.group(1)
-        server_emote = self.find_emote(emote_id)
+        emote_id = self.get_emote_id(emote)
+        server_emote = self.emote_cache.get(emote_id)
         try:
             await self.bot.add_reaction(message, server_emote or emote_id)
         except discord.HTTPException:  # Failed to find the emoji
@@ -127,8 +149,16 @@ class EmbedReactor:
             result = True
         return result
 
+    def get_emote_id(self, emote: str) -> str:
+        emote_id = self.emote_ids.get(emote)
+        if emote_id is None:
+            emote_match = EMOTE_REGEX.fullmatch(emote)
+            emote_id = emote if emote_match is None else emote_match.group(1)
+            self.emote_ids[emote] = emote_id
+        return emote_id
+
     def find_emote(self, emote: str):
-        return self.emote_cache.get(emote)
+        return self.emote_cache.get(self.get_emote_id(emote))
 
     # Config
     def check_configs(self):
@@ -155,6 +185,13 @@ class EmbedReactor:
         self.config = dataIO.load_json(self.CONFIG_FILE_PATH)
 
     def save_data(self):
+        if self.save_handle is None:
+            self.save_handle = self.bot.loop.call_later(self.SAVE_DELAY, self.flush_data)
+
+    def flush_data(self):
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
         dataIO.save_json(self.CONFIG_FILE_PATH, self.config)
 
 
@@ -1,9 +1,7 @@
 import asyncio
-import copy
 import discord
 import os
 import os.path
-import re
 
 from discord.ext import commands
 from .utils.dataIO import dataIO
@@ -12,21 +10,20 @@ from .utils import checks
 
 class HelpAutoDelete:
     """Cog which allows you to set a timeout after which help messages delete themselves"""
+
+    __slots__ = ("bot", "save_handle", "config", "help_timeouts", "__og_default_help_cmd",
+                 "__og_send_cmd_help")
     
     DATA_FOLDER = "data/client_modification"
     CONFIG_FILE_PATH = DATA_FOLDER + "/config.json"
+    SAVE_DELAY = 2
     
     SERVER_DEFAULT = {"help_timeout": 0}
     CONFIG_DEFAULT = {}
-
-    _MENTIONS_REPLACE = {
-        '@everyone': '@\u200beveryone',
-        '@here': '@\u200bhere'
-    }
-    _MENTION_PATTERN = re.compile('|'.join(_MENTIONS_REPLACE.keys()))
     
     def __init__(self, bot):
         self.bot = bot
+        self.save_handle = None
         self.check_configs()
         self.load_data()
         asyncio.ensure_future(self._init_modifications())
@@ -39,6 +36,8 @@ class HelpAutoDelete:
     def __unload(self):
         # This method is ran whenever the bot unloads this cog.
         self.revert_modifications()
+        if self.save_handle is not None:
+            self.flush_data()
 
     # Commands
     @commands.command(name="help_timeout", pass_context=True, no_pm=True)
@@ -48,6 +47,7 @@ class HelpAutoDelete:
         if timeout >= 0:
             conf = self.get_config(ctx.message.server.id)
             conf["help_timeout"] = timeout
+            self.help_timeouts[ctx.message.server.id] = timeout
             self.save_data()
             if ctx.message.channel.permissions_for(ctx.message.channel.server.me).manage_messages:
                 await self.bot.delete_message(ctx.message)
@@ -69,13 +69,10 @@ class HelpAutoDelete:
         bot = ctx.bot
         destination = ctx.message.author if bot.pm_help else ctx.message.channel
 
-        def repl(obj):
-            return self._MENTIONS_REPLACE.get(obj.group(0), "")
-
         pages = None
         command = bot
         for key in cmds:
-            name = self._MENTION_PATTERN.sub(repl, key)
+            name = key.replace("@everyone", "@\u200beveryone").replace("@here", "@\u200bhere")
             if name in bot.cogs:
                 command = bot.cogs.get(name)
             elif isinstance(command, discord.ext.commands.GroupMixin):
@@ -90,9 +87,12 @@ class HelpAutoDelete:
             pages = bot.formatter.format_help_for(ctx, command)
 
         if bot.pm_help is None:
-            characters = sum(map(lambda l: len(l), pages))
-            if characters > 1000:
-                destination = ctx.message.author
+            characters = 0
+            for page in pages:  # Stops counting as soon as the help is known to be too long
+                characters += len(page)
+                if characters > 1000:
+                    destination = ctx.message.author
+                    break
 
         await self.temp_send(destination, pages, [ctx.message])  # All of that copy paste for this one line change
     
@@ -101,32 +101,35 @@ class HelpAutoDelete:
         self.bot.commands["help"].callback = self.__og_default_help_cmd
 
     async def temp_send(self, channel, pages, msgs):
-        for page in pages:
+        for page in pages:  # Sent one by one since concurrent sends could shuffle the pages
             msgs.append(await self.bot.send_message(channel, page))
         if self and hasattr(channel, "server"):
-            config = self.get_config(channel.server.id)
-            if config is not None:
-                seconds = config.get("help_timeout", 0)
-                if seconds > 0:
-                    await asyncio.sleep(seconds)
-                    await self.delete_messages(msgs)
+            seconds = self.help_timeouts.get(channel.server.id, 0)
+            if seconds > 0:
+                asyncio.ensure_future(self.delete_later(list(msgs), seconds))
+
+    async def delete_later(self, messages, seconds):
+        await asyncio.sleep(seconds)
+        await self.delete_messages(messages)
 
     async def delete_messages(self, messages):
-        while len(messages) > 0:
-            if len(messages) == 1:
-                await self.bot.delete_message(messages[0])
-                messages = messages[:-1]
-            else:
-                await self.bot.delete_messages(messages[-100:])
-                messages = messages[:-100]
+        if not messages:
+            return
+        if len(messages) == 1:
+            await self.bot.delete_message(messages[0])
+        elif len(messages) <= 100:  # The usual case where everything fits in a single bulk delete
+            await self.bot.delete_messages(messages)
+        else:
+            for i in range(0, len(messages), 100):
+                chunk = messages[i:i + 100]
+                if len(chunk) == 1:
+                    await self.bot.delete_message(chunk[0])
+                else:
+                    await self.bot.delete_messages(chunk)
     
     # Config
     def get_config(self, server_id):
-        config = self.config.get(server_id)
-        if config is None:
-            config = copy.deepcopy(self.SERVER_DEFAULT)
-            self.config[server_id] = config
-        return self.config.get(server_id)
+        return self.config.setdefault(server_id, dict(self.SERVER_DEFAULT))  # The default is flat
     
     def check_configs(self):
         self.check_folders()
@@ -148,9 +151,18 @@ class HelpAutoDelete:
     def load_data(self):
         # Here, you load the data from the config file.
         self.config = dataIO.load_json(self.CONFIG_FILE_PATH)
+        # {server.id: help_timeout} kept aside since it's read on every help message
+        self.help_timeouts = {server_id: c.get("help_timeout", 0) for server_id, c in self.config.items()}
     
     def save_data(self):
-        # Save all the data (if needed)
+        # Writes at most SAVE_DELAY seconds after the first unsaved change, later changes don't push it back
+        if self.save_handle is None:
+            self.save_handle = self.bot.loop.call_later(self.SAVE_DELAY, self.flush_data)
+    
+    def flush_data(self):
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
         dataIO.save_json(self.CONFIG_FILE_PATH, self.config)
 
 
@@ -1,4 +1,5 @@
 import asyncio
+import bisect
 import discord
 import os.path
 import os
@@ -7,6 +8,7 @@ import datetime
 import typing
 import aiohttp
 import json
+import sys
 
 from .utils import checks
 from .utils.dataIO import dataIO
@@ -15,7 +17,22 @@ from discord.ext.commands.context import Context
 
 
 MessageList = typing.List[discord.Message]
-TreeCache = typing.Dict[str, typing.Set[discord.Message]]
+# {word: {message.id: {(line index, word index)}}} positions of every word in the channel's messages
+TreeCache = typing.Dict[str, typing.Dict[str, typing.Set[typing.Tuple[int, int]]]]
+
+
+class MessageRef:
+    """The parts of a cached message which the search needs, much lighter than keeping the discord.Message"""
+
+    __slots__ = ("id", "channel_id", "author_mention", "timestamp", "content", "lines")
+
+    def __init__(self, message: discord.Message, lines: typing.List[typing.List[str]]):
+        self.id = message.id
+        self.channel_id = message.channel.id
+        self.author_mention = message.author.mention
+        self.timestamp = message.timestamp
+        self.content = message.content
+        self.lines = lines  # [[word]] the wordified words of each line
 
 
 class IndexedSearch:
@@ -34,10 +51,11 @@ class IndexedSearch:
     TEMP_MESSAGE_TIMEOUT = 60 * 5  # seconds
     DOWNLOAD_TIMEOUT = 15  # seconds
     DOWNLOAD_HEADERS = {"User-Agent": "Mozilla"}
+    FETCH_CONCURRENCY = 8  # Maximum number of channels fetched at the same time when building the cache
 
     # Time humanization
     TIME_FORMATS = ["{} seconds", "{} minutes", "{} hours", "{} days", "{} weeks"]
-    TIME_FRACTIONS = [60, 60, 24, 7]
+    TIME_DIVISORS = [1, 60, 60 * 60, 60 * 60 * 24, 60 * 60 * 24 * 7]  # Seconds in each of the TIME_FORMATS
 
     # Messages
     CATEGORY_NOT_FOUND = ":x: Category not found"
@@ -75,6 +93,8 @@ class IndexedSearch:
         self.load_data()
         self.cache_ready = asyncio.Event()
         self.cache = {}  # {server.id: {channel.id: TreeCache}}
+        self.messages = {}  # {message.id: MessageRef} of the cached messages
+        self.timelines = {}  # {channel.id: [(timestamp, message.id)]} of the cached messages, oldest first
         self.session = None
         asyncio.ensure_future(self.fetch_cache())
 
@@ -115,15 +135,17 @@ class IndexedSearch:
                 msg = await self.bot.send_message(message.channel, self.WAITING)
                 await self.cache_ready.wait()
                 await self.bot.delete_message(msg)
-            abbrevs = server_config["abbreviations"]
-            msgs = self.find_in_trees(self.wordify(abbrevs, words), abbrevs, trees)
+            search_terms = [sys.intern(word) for word in self.wordify(server_config["abbreviations"], words)]
+            msgs = self.find_in_trees(search_terms, trees)
             days_diff = datetime.timedelta(days=server_config["maximum_days"])
             humanized_days = self.humanize_time(days_diff.total_seconds())
-            minimum_date = datetime.datetime.utcnow() - days_diff
-            msgs = sorted(filter(lambda m: m[1].timestamp > minimum_date, msgs),
-                          key=lambda m: m[1].timestamp, reverse=True)
+            now = datetime.datetime.utcnow()  # Shared by the filter and the results' ages
+            minimum_date = now - days_diff
+            if len(msgs) > 0:  # Most searches for unindexed words have nothing to filter nor sort
+                msgs = [m for m in msgs if m[1].timestamp > minimum_date]
+                msgs.sort(key=lambda m: m[1].timestamp, reverse=True)
             if len(msgs) > 0:
-                embed = self.build_search_embed(words, abbrevs, humanized_days, msgs[:10])
+                embed = self.build_search_embed(words, search_terms, humanized_days, msgs[:10], now)
                 if len(msgs) > 10:
                     embed.set_footer(text=self.SEARCH_RESULT_MORE)
             else:
@@ -144,12 +166,13 @@ class IndexedSearch:
         server = message.server
         server_conf = self.config.setdefault(server.id, self.DEFAULT_SERVER_CONFIG)
         haystacks = server_conf["haystacks"]
-        if channel.id in haystacks.values():
+        if channel.id in self.haystack_names:
             response = self.CHANNEL_ALREADY_INDEXED.format(channel.mention)
         elif name.lower() in haystacks:
             response = self.CATEGORY_ALREADY_USED.format(name)
         else:
             haystacks[name.lower()] = channel.id
+            self.haystack_names[channel.id] = name.lower()
             await self.fetch_channel_cache(channel, datetime.timedelta(days=server_conf["maximum_days"]))
             self.save_data()
             response = self.INDEX_ADDED.format(channel.mention, name)
@@ -163,9 +186,9 @@ class IndexedSearch:
         haystacks = self.config.get(server.id, {}).get("haystacks", {})
         embed = discord.Embed(**self.INDEX_LIST_EMBED)
         embed.title = embed.title.format(server.name)
-        for name, channel_id in haystacks.items():
-            embed.description += self.INDEX_LIST_ENTRY.format(channel=channel_id, name=name) + "\n"
-        embed.description = embed.description or self.INDEX_LIST_EMPTY
+        entries = [self.INDEX_LIST_ENTRY.format(channel=channel_id, name=name)
+                   for name, channel_id in haystacks.items()]
+        embed.description = "\n".join(entries) or self.INDEX_LIST_EMPTY
         await self.temp_send(message.channel, [message], embed=embed)
 
     @_search.command(name="remove_index", aliases=["del_index"], pass_context=True, no_pm=True)
@@ -175,13 +198,15 @@ class IndexedSearch:
         message = ctx.message
         server = message.server
         server_conf = self.config.get(server.id, self.DEFAULT_SERVER_CONFIG)
-        pair = discord.utils.find(lambda o: o[1] == channel.id, server_conf["haystacks"].items())
-        if pair is None:
+        name = self.haystack_names.get(channel.id)
+        if name is None or server_conf["haystacks"].get(name) != channel.id:  # Not indexed in this server
             response = self.CHANNEL_NOT_INDEXED.format(channel.mention)
         else:
-            server_conf["haystacks"].pop(pair[0], ...)
+            server_conf["haystacks"].pop(name, ...)
+            del self.haystack_names[channel.id]
             self.save_data()
-            self.cache.get(server.id, {}).pop(pair[1], ...)
+            self.cache.get(server.id, {}).pop(channel.id, ...)
+            self.forget_channel(channel.id)
             response = self.INDEX_REMOVED.format(channel=channel.mention)
         await self.temp_send(message.channel, [message], response)
 
@@ -197,10 +222,19 @@ class IndexedSearch:
         else:
             server = message.server
             server_conf = self.config.setdefault(server.id, self.DEFAULT_SERVER_CONFIG)
+            old_days = server_conf["maximum_days"]
             server_conf["maximum_days"] = days
             self.save_data()
-            self.cache.clear()
-            await self.fetch_cache()
+            # Only fetch or drop the difference instead of rebuilding the cache
+            now = datetime.datetime.utcnow()
+            for channel_id, trees in list(self.cache.get(server.id, {}).items()):
+                if days > old_days:
+                    channel = self.bot.get_channel(channel_id)
+                    if channel is not None:
+                        await self.fetch_channel_cache(channel, datetime.timedelta(days=days),
+                                                       until=now - datetime.timedelta(days=old_days))
+                elif days < old_days:
+                    self.prune_channel_cache(channel_id, trees, now - datetime.timedelta(days=days))
             response = self.MAX_DAYS_SET.format(server=server.name, days=days)
         await self.temp_send(message.channel, [message], response)
 
@@ -241,135 +275,180 @@ class IndexedSearch:
         embed = discord.Embed(**self.ABBREV_LIST_EMBED)
         embed.title = embed.title.format(server=message.server.name)
         abbrevs = self.config.get(message.server.id, self.DEFAULT_SERVER_CONFIG)["abbreviations"]
-        if len(abbrevs) == 0:
-            embed.description = self.ABBREV_LIST_EMPTY
-        for abbrev, word in abbrevs.items():
-            embed.description += "{} **-->** {}\n".format(abbrev, word)
+        entries = ["{} **-->** {}".format(abbrev, word) for abbrev, word in abbrevs.items()]
+        embed.description = "\n".join(entries) or self.ABBREV_LIST_EMPTY
         await self.temp_send(message.channel, [message], embed=embed)
 
     # Utilities
     async def download_json_file(self, url: str) -> dict:
-        """Downloads the content of "url" into a BytesIO object asynchronously"""
-        if self.session is None:
-            self.session = aiohttp.ClientSession()
-        async with self.session.get(url, timeout=self.DOWNLOAD_TIMEOUT, headers=self.DOWNLOAD_HEADERS) as response:
-            try:
-                content = await response.json()
-            except (json.JSONDecodeError, aiohttp.ClientResponseError):
+        """Downloads the JSON object at "url" asynchronously, None if it isn't one"""
+        async with self.get_session().get(url, timeout=self.DOWNLOAD_TIMEOUT) as response:
+            body = await response.read()
+        try:  # Parsed from the raw body since attachments aren't always served with a JSON content type
+            content = json.loads(body.decode("utf-8"))
+        except ValueError:  # Includes JSONDecodeError and UnicodeDecodeError
+            content = None
+        else:
+            if not isinstance(content, dict):
                 content = None
-            else:
-                if not isinstance(content, dict):
-                    content = None
         return content
 
-    def build_search_embed(self, search_terms: typing.List[str], abbrevs: typing.Dict[str, str], days: str,
-                           results: typing.List[typing.Tuple[int, discord.Message]]) -> discord.Embed:
-        embed = discord.Embed(title=self.SEARCH_RESULT_TITLE.format(" ".join(search_terms)))
-        embed.description = self.SEARCH_RESULT_DESCRIPTION.format(time=days, channel=results[0][1].channel.mention)
-        embed.description += "\n"
+    def get_session(self) -> aiohttp.ClientSession:
+        """Returns the session shared by the downloads, (re)created from within the event loop when needed"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(headers=self.DOWNLOAD_HEADERS)
+        return self.session
+
+    def build_search_embed(self, words: typing.List[str], search_terms: typing.List[str], days: str,
+                           results: typing.List[typing.Tuple[typing.Tuple[int, int], MessageRef]],
+                           now: datetime.datetime) -> discord.Embed:
+        embed = discord.Embed(title=self.SEARCH_RESULT_TITLE.format(" ".join(words)))
+        channel_mention = "<#{}>".format(results[0][1].channel_id)
+        lines = [self.SEARCH_RESULT_DESCRIPTION.format(time=days, channel=channel_mention), ""]
         embed.colour = discord.Colour.green()
-        search_terms = self.wordify(abbrevs, search_terms)
-        now = datetime.datetime.utcnow()
-        for i, message in results:
-            author = message.author.mention
+        for (i, match), message in results:
+            author = message.author_mention
             content = message.content.splitlines()[i]
             raw_words = content.split(" ")
-            words = self.wordify(abbrevs, raw_words)
-            match = self.subsequence_in_sequence(words, search_terms)
             raw_words[match] = "`" + raw_words[match]
             raw_words[match + len(search_terms) - 1] = raw_words[match + len(search_terms) - 1] + "`"
             content = " ".join(raw_words)
-            time_diff = now - message.timestamp
-            time = self.humanize_time(time_diff.total_seconds())
-            embed.description += "\n" + self.SEARCH_RESULT_MESSAGE.format(author=author, time=time, content=content)
+            time = self.humanize_time((now - message.timestamp).total_seconds())
+            lines.append(self.SEARCH_RESULT_MESSAGE.format(author=author, time=time, content=content))
+        embed.description = "\n".join(lines)
         return embed
 
     async def fetch_cache(self):
         self.cache_ready.clear()
         await self.bot.wait_until_ready()
+        semaphore = asyncio.Semaphore(self.FETCH_CONCURRENCY)
+
+        async def fetch_one(channel, go_back):
+            async with semaphore:
+                await self.fetch_channel_cache(channel, go_back)
+        fetches = []
         for server_config in self.config.values():
             go_back = datetime.timedelta(days=server_config["maximum_days"])
             for channel_id in server_config["haystacks"].values():
                 channel = self.bot.get_channel(channel_id)
                 if channel is not None:
-                    await self.fetch_channel_cache(channel, go_back)
+                    fetches.append(fetch_one(channel, go_back))
+        results = await asyncio.gather(*fetches, return_exceptions=True)
+        for error in filter(lambda r: isinstance(r, Exception), results):
+            self.logger.error("Failed to fetch a channel's cache", exc_info=error)
         self.cache_ready.set()
 
-    async def fetch_channel_cache(self, channel: discord.Channel, go_back: datetime.timedelta):
+    async def fetch_channel_cache(self, channel: discord.Channel, go_back: datetime.timedelta,
+                                  until: datetime.datetime=None):
+        """Caches the messages of the last `go_back` in `channel`, stopping at `until` if given"""
         trees = self.cache.setdefault(channel.server.id, {}).setdefault(channel.id, {})
         after = datetime.datetime.utcnow() - go_back
+        # Looked up once for the whole channel instead of once per message
+        abbrevs = self.config.get(channel.server.id, self.DEFAULT_SERVER_CONFIG)["abbreviations"]
+        index_message = self.index_message
         total = 0
         keep_going = True
-        while keep_going:
+        while keep_going:  # Paged by hand since the iterator only stops after an extra empty page
             count = 0
-            async for message in self.bot.logs_from(channel, after=after, reverse=True):
-                self.parse_message(message, trees)
+            async for message in self.bot.logs_from(channel, limit=100, after=after, reverse=True):
+                # Not passed as `before` since the endpoint ignores it next to `after`, it would only filter locally
+                if until is not None and message.timestamp >= until:
+                    break  # The rest is already cached, the page is partial so the fetch ends
+                index_message(message, trees, abbrevs)
                 count += 1
                 after = message
-            keep_going = count == 100
+            keep_going = count == 100  # A partial page is the end of the history
             total += count
         self.logger.info("Cached {} messages for #{}".format(total, channel.name))
 
-    def find_in_trees(self, search_terms: typing.List[str], abbrevs: typing.Dict[str, str], tree: TreeCache) \
-            -> typing.List[typing.Tuple[int, discord.Message]]:
+    def prune_channel_cache(self, channel_id: str, tree: TreeCache, oldest: datetime.datetime):
+        """Removes the messages of the channel posted before `oldest` from the cache"""
+        timeline = self.timelines.get(channel_id)
+        if timeline:
+            end = bisect.bisect_left(timeline, (oldest,))  # Only the pruned messages are visited
+            for _, message_id in timeline[:end]:
+                ref = self.messages.pop(message_id, None)
+                if ref is not None:
+                    self.unindex_message(ref, tree)
+            del timeline[:end]
+
+    def find_in_trees(self, search_terms: typing.List[str], tree: TreeCache) \
+            -> typing.List[typing.Tuple[typing.Tuple[int, int], MessageRef]]:
+        """Finds the messages with a line containing the (already wordified) search terms
+
+        Returns a list of ((line index, word index), message) for the first match in each message"""
         result = []
-        msgs = tree.get(search_terms[0], set())
-        for msg in msgs:
-            try:
-                line = discord.utils.find(self.create_matcher(abbrevs, search_terms),
-                                          enumerate(msg.content.splitlines()))[0]
-            except TypeError as e:
-                self.logger.warning("Error: {}, Search terms: {}, message's lines: {}".format(e, search_terms,
-                                                                                              msg.content.splitlines()))
-            else:
-                if line is not None:
-                    result.append((line, msg))
+        postings = []
+        for term in search_terms:
+            posting = tree.get(term)
+            if posting is None:  # Nothing can match, the other terms don't need to be looked up
+                break
+            postings.append(posting)
+        else:
+            # Only the messages containing every term can match, then the terms must follow each other on a line
+            candidates = set(min(postings, key=len)).intersection(*postings)
+            for message_id in candidates:
+                for line, position in sorted(postings[0][message_id]):
+                    if all((line, position + i) in p[message_id] for i, p in enumerate(postings)):
+                        result.append(((line, position), self.messages[message_id]))
+                        break
         return result
 
-    def create_matcher(self, abbrevs: typing.Dict[str, str], terms: typing.List[str]):
-        def match_line(line: str):
-            match = self.subsequence_in_sequence(self.wordify(abbrevs, line[1].split(" ")),
-                                                 self.wordify(abbrevs, terms))
-            return match is not None
-        return match_line
-
     def wordify(self, abbrevs: typing.Dict[str, str], word_list: typing.List[str]) -> typing.List[str]:
-        result = []
-        for word in word_list:
-            word = word.lower().strip()
-            result.append(abbrevs.get(word, word))
-        return result
-
-    def subsequence_in_sequence(self, source, target, start=0, end=None):
-        """Naive search for target in source"""
-        m = len(source)
-        n = len(target)
-        if end is None:
-            end = m
-        else:
-            end = min(end, m)
-        if n == 0 or (end - start) < n:
-            # target is empty, or longer than source, so obviously can't be found.
-            return None
-        for i in range(start, end - n + 1):
-            if source[i:i + n] == target:
-                return i
-        return None
+        words = [word.lower().strip() for word in word_list]
+        if len(abbrevs) > 0:  # Each word maps to exactly one word so the positions match the original words
+            get = abbrevs.get
+            words = [get(word, word) for word in words]
+        return words
 
     def parse_message(self, message: discord.Message, tree: TreeCache):
-        self._do_for_word_on_cache(message, tree, set.add)
-
-    def remove_message(self, message: discord.Message, tree: TreeCache):
-        self._do_for_word_on_cache(message, tree, set.discard)
-
-    def _do_for_word_on_cache(self, message: discord.Message, tree: TreeCache,
-                              func: typing.Callable[[set, discord.Message], None]):
         if message is not None:
             abbrevs = self.config.get(message.server.id, self.DEFAULT_SERVER_CONFIG)["abbreviations"]
-            for word in message.content.split(" "):
-                word = word.lower().strip()
-                word = abbrevs.get(word, word)
-                func(tree.setdefault(word, set()), message)
+            self.index_message(message, tree, abbrevs)
+
+    def index_message(self, message: discord.Message, tree: TreeCache, abbrevs: typing.Dict[str, str]):
+        # Tokenized once here so searches don't need to split and wordify the messages again
+        # Interned so every occurrence of a word shares one string in memory (search terms are interned as well)
+        lines = [[sys.intern(word) for word in self.wordify(abbrevs, line.split(" "))]
+                 for line in message.content.splitlines()]
+        message_id = message.id
+        self.messages[message_id] = MessageRef(message, lines)
+        # Kept sorted so pruning doesn't go through every message, new messages are inserted at the end
+        bisect.insort(self.timelines.setdefault(message.channel.id, []), (message.timestamp, message_id))
+        for line, words in enumerate(lines):
+            for position, word in enumerate(words):
+                postings = tree.get(word)
+                if postings is None:
+                    postings = tree[word] = {}
+                positions = postings.get(message_id)
+                if positions is None:
+                    positions = postings[message_id] = set()
+                positions.add((line, position))
+
+    def remove_message(self, message: typing.Union[discord.Message, MessageRef], tree: TreeCache):
+        if message is not None:
+            ref = self.messages.pop(message.id, None)
+            if ref is not None:  # Otherwise the message was never cached
+                timeline = self.timelines.get(ref.channel_id, [])
+                entry = (ref.timestamp, ref.id)
+                i = bisect.bisect_left(timeline, entry)
+                if i < len(timeline) and timeline[i] == entry:
+                    del timeline[i]
+                self.unindex_message(ref, tree)
+
+    def unindex_message(self, ref: MessageRef, tree: TreeCache):
+        for words in ref.lines:
+            for word in set(words):
+                postings = tree.get(word)
+                if postings is not None:
+                    postings.pop(ref.id, None)
+                    if len(postings) == 0:
+                        del tree[word]
+
+    def forget_channel(self, channel_id: str):
+        """Drops the cached messages of the channel once its trees are gone"""
+        for _, message_id in self.timelines.pop(channel_id, ()):
+            self.messages.pop(message_id, None)
 
     def _on_message_action(self, *, parse: discord.Message=None, remove: discord.Message=None):
         either = parse or remove
@@ -390,20 +469,21 @@ class IndexedSearch:
         Else, deletes only the sent message"""
         sleep_timeout = kwargs.pop("sleep_timeout", self.TEMP_MESSAGE_TIMEOUT)
         messages.append(await self.bot.send_message(channel, *args, **kwargs))
-        await asyncio.sleep(sleep_timeout)
+        asyncio.ensure_future(self.delete_later(messages, sleep_timeout))
+
+    async def delete_later(self, messages: MessageList, seconds: float):
+        await asyncio.sleep(seconds)
         await self.delete_messages(messages)
 
     async def delete_messages(self, messages: MessageList):
         """Deletes an arbitrary number of messages by batches
 
-        Basically runs discord.Client.delete_messages for every 100 messages until none are left"""
+        Basically runs discord.Client.delete_messages for every 100 messages, all at once"""
         messages = list(filter(self.message_filter, messages))
-        while len(messages) > 0:
-            if len(messages) == 1:
-                await self.bot.delete_message(messages.pop())
-            else:
-                await self.bot.delete_messages(messages[-100:])
-                messages = messages[:-100]
+        batches = [messages[i:i + 100] for i in range(0, len(messages), 100)]
+        # Bulk deletes need at least 2 messages so a lone message is deleted on its own
+        await asyncio.gather(*(self.bot.delete_message(b[0]) if len(b) == 1 else self.bot.delete_messages(b)
+                               for b in batches))
 
     def message_filter(self, message: discord.Message) -> bool:
         result = False
@@ -414,36 +494,13 @@ class IndexedSearch:
         return result
 
     def humanize_time(self, time: int) -> str:
-        """Returns a string of the humanized given time keeping only the 2 biggest formats
+        """Returns a string of the humanized given time keeping only the biggest format
         Examples:
-        1661410 --> 2 weeks 5 days (hours, mins, seconds are ignored)
+        1661410 --> 2 weeks (days, hours, mins, seconds are ignored)
         30 --> 30 seconds"""
-        times = []
-        # 90 --> divmod(90, 60) --> (1, 30) --> (1m + 30s)
-        for time_f in zip(self.TIME_FRACTIONS, self.TIME_FORMATS):
-            time, units = divmod(time, time_f[0])
-            if units > 0:
-                times.append(self.plural_format(int(units), time_f[1]))
-        if time > 0:
-            times.append(self.plural_format(int(time), self.TIME_FORMATS[-1]))
-        return times[-1]
-
-    def plural_format(self, raw_amount: typing.Union[int, float], format_string: str, *,
-                      singular_format: str=None) -> str:
-        """Formats a string for plural and singular forms of an amount
-
-        The amount given is rounded.
-        raw_amount is an integer (rounded if something else is given)
-        format_string is the string to use when formatting in plural
-        singular_format is the string to use for singular
-            By default uses the plural and removes the last character"""
-        amount = round(raw_amount)
-        result = format_string.format(raw_amount)
-        if singular_format is None:
-            result = format_string.format(raw_amount)[:-1 if amount == 1 else None]
-        elif amount == 1:
-            result = singular_format.format(raw_amount)
-        return result
+        i = max(bisect.bisect_right(self.TIME_DIVISORS, time) - 1, 0)
+        amount = int(time // self.TIME_DIVISORS[i])
+        return self.TIME_FORMATS[i].format(amount)[:-1 if amount == 1 else None]  # Singular drops the "s"
 
     # Config
     def check_configs(self):
@@ -465,6 +522,9 @@ class IndexedSearch:
 
     def load_data(self):
         self.config = dataIO.load_json(self.CONFIG_FILE_PATH)
+        # {channel.id: name} reverse of every server's haystacks
+        self.haystack_names = {channel_id: name for server_config in self.config.values()
+                               for name, channel_id in server_config["haystacks"].items()}
 
     def save_data(self):
         dataIO.save_json(self.CONFIG_FILE_PATH, self.config)
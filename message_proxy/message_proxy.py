@@ -1,17 +1,12 @@
 import asyncio
-import copy
 import discord
-import os.path
-import os
-import math
 import logging
-import io
+import tempfile
 
 import aiohttp  # Ensured by discord since this is a dependency of discord.py
 
 from discord.ext import commands
 from .utils import checks
-from .utils.dataIO import dataIO
 
 
 class MessageProxy:
@@ -23,9 +18,19 @@ class MessageProxy:
     FAILED_TO_FIND_MESSAGE = ":x: Failed to find the message with id {} in {}."
     COMMAND_FORMAT = "{p}msg edit <#{c_id}> {m_id} ```\n{content}```"
 
+    # Behavior constants
+    DOWNLOAD_HEADERS = {"User-Agent": "Mozilla"}
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024  # bytes, small enough that the blocking file writes barely hold the loop
+
     def __init__(self, bot: discord.Client):
         self.bot = bot
         self.logger = logging.getLogger("red.ZeCogs.message_proxy")
+        self.session = None
+
+    # Events
+    def __unload(self):
+        if self.session is not None:
+            self.session.close()
 
     # Commands
     @commands.group(name="message", aliases=["msg"], pass_context=True, no_pm=True, invoke_without_command=True)
@@ -43,20 +48,31 @@ class MessageProxy:
         If no content is provided, at least an attachment must be provided."""
         message = ctx.message
         attachment = self.get_attachment(message)
+        # Mentions don't notify anyone when they're edited in so only those messages go through a placeholder
+        first_content = "Placeholder" if content is not None and "@" in content else content
         if attachment is not None:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url=attachment[0], headers={"User-Agent": "Mozilla"}) as response:
-                    file = io.BytesIO(await response.read())
-            msg = await self.bot.send_file(channel, file, content=content and "Placeholder", filename=attachment[1])
+            with tempfile.TemporaryFile() as file:  # Streamed through a file so attachments aren't held in memory
+                async with self.get_session().get(url=attachment[0]) as response:
+                    chunk = await response.content.read(self.DOWNLOAD_CHUNK_SIZE)
+                    while chunk:
+                        file.write(chunk)
+                        chunk = await response.content.read(self.DOWNLOAD_CHUNK_SIZE)
+                file.seek(0)
+                # On Windows it's a wrapper which aiohttp can't stream, the actual file object is inside of it
+                file = getattr(file, "file", file)
+                msg = await self.bot.send_file(channel, file, content=first_content, filename=attachment[1])
         else:
-            msg = await self.bot.send_message(channel, "Placeholder")
+            msg = await self.bot.send_message(channel, first_content or "Placeholder")
+        requests = []
         if content is not None:
-            await self.bot.edit_message(msg, new_content=content)
+            if first_content != content:
+                requests.append(self.bot.edit_message(msg, new_content=content))
             reply = self.COMMAND_FORMAT.format(p=ctx.prefix, content=content, m_id=msg.id, c_id=channel.id)
-            await self.bot.delete_message(ctx.message)
+            requests.append(self.bot.delete_message(ctx.message))
         else:
             reply = self.MESSAGE_SENT.format(m=msg.id, c=channel.id, s=channel.server.id)
-        await self.bot.send_message(message.channel, reply)
+        requests.append(self.bot.send_message(message.channel, reply))
+        await asyncio.gather(*requests)  # They only need the sent message's id so they don't wait for each other
 
     @_messages.command(name="edit", pass_context=True)
     @checks.mod_or_permissions(manage_server=True)
@@ -64,9 +80,13 @@ class MessageProxy:
         """Edit the message with id message_id in the given channel
 
         No attachment can be provided."""
-        try:
-            msg = await self.bot.get_message(channel, message_id)
-        except discord.errors.HTTPException:
+        msg = None
+        if message_id.isdigit() and len(message_id) <= 20:  # Anything else can't be an id, Discord isn't asked
+            try:
+                msg = await self.bot.get_message(channel, message_id)
+            except discord.errors.HTTPException:
+                pass
+        if msg is None:
             response = self.FAILED_TO_FIND_MESSAGE.format(message_id, channel.mention)
         else:
             await self.bot.edit_message(msg, new_content=new_content)
@@ -81,6 +101,12 @@ class MessageProxy:
         attachment = message.attachments[0]
         return attachment["url"], attachment["filename"]
 
+    def get_session(self) -> aiohttp.ClientSession:
+        """Returns the session shared by the attachment downloads, (re)created from within the event loop when needed"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(headers=self.DOWNLOAD_HEADERS)
+        return self.session
+
 
 def setup(bot):
     bot.add_cog(MessageProxy(bot))
@@ -3,7 +3,6 @@ import os.path
 import os
 import logging
 import asyncio
-import collections
 import random
 
 from discord.ext import commands
@@ -22,6 +21,7 @@ class Periodic:
 
     DATA_FOLDER = "data/periodic"
     CONFIG_FILE_PATH = DATA_FOLDER + "/config.json"
+    SAVE_DELAY = 2  # Seconds, every add/remove/edit made meanwhile goes in the same write
 
     CONFIG_DEFAULT = {}
     """
@@ -76,13 +76,15 @@ class Periodic:
     def __init__(self, bot: discord.Client):
         self.bot = bot
         self.logger = logging.getLogger("red.ZeCogs.periodic")
+        self.save_handle = None
         self.check_configs()
         self.load_data()
         self.type_map = {"message": self.bot.send_message, "customcommand": self.send_customcom}
         self.channel_events = {}  # channel.id: asyncio.Event
         self.channel_loops = {}  # channel.id: asyncio.Future
-        self.channel_triggers = {}  # channel.id: [asyncio.Future]
-        self.channel_messages = collections.Counter()  # channel.id: count (decrements from message_interval to 0)
+        self.channel_triggers = {}  # channel.id: [asyncio.TimerHandle]
+        # channel.id: [count, asyncio.Event] (count decrements from message_interval to 0, then sets the event)
+        self.message_triggers = {}
         asyncio.ensure_future(self.initialize())
 
     # Events
@@ -92,52 +94,63 @@ class Periodic:
             server = self.bot.get_server(server_id)
             if server is not None:
                 for channel_id, config in server_conf.items():
-                    channel = server.get_channel(channel_id)
-                    if channel is not None:
-                        self.start_triggers(config, channel)
+                    # Like in the commands, the triggers only start once the channel has something to send
+                    if len(config["messages"]) > 0:
+                        channel = server.get_channel(channel_id)
+                        if channel is not None:
+                            self.start_triggers(config, channel)
 
     async def wait_for_channel(self, channel: discord.Channel):
-        while channel.id in self.channel_events:
-            await self.channel_events[channel.id].wait()
-            if channel.id in self.channel_events:
-                self.stop_triggers(channel.id)
-                config = self.get_config(channel.server.id, channel.id)
+        # Bound once since this loop lives as long as the channel's periodic actions
+        channel_id = channel.id
+        events = self.channel_events
+        type_map = self.type_map
+        while channel_id in events:
+            await events[channel_id].wait()
+            if channel_id in events:
+                self.stop_triggers(channel_id)
+                config = self.get_config(channel.server.id, channel_id)
                 messages = config["messages"]
-                cursor = (config["cursor"] + len(messages)) % len(messages)
-                og_cursor = cursor
                 last_sent_id = config.get("last_sent_id")
                 if last_sent_id is not None:
+                    # Deleted by id since fetching the message first would be another request on the channel's limit
                     try:
-                        msg = await self.bot.get_message(channel, last_sent_id)
-                        await self.bot.delete_message(msg)
+                        await self.bot.http.delete_message(channel_id, last_sent_id, channel.server.id)
                     except discord.errors.DiscordException:
                         pass
                 output = None
-                while output is None:
+                tries = 0
+                while output is None and len(messages) > 0:
+                    # Read from the config every time since deleting an action while this is awaited moves the cursor
+                    cursor = config["cursor"] % len(messages)
                     chosen_one = messages[cursor]
-                    consumer = self.type_map[chosen_one["type"]]
+                    config["cursor"] = (cursor + 1) % len(messages)  # Moved before awaiting for the same reason
+                    consumer = type_map[chosen_one["type"]]
                     output = await consumer(channel, chosen_one["value"])
-                    cursor = (cursor + 1) % len(messages)
-                    if cursor == og_cursor:  # Gone full circle
+                    tries += 1
+                    if tries >= len(messages):  # Gone full circle
                         output = output or False
                 if isinstance(output, discord.Message):
                     config["last_sent_id"] = output.id
-                config["cursor"] = cursor
                 self.save_data()
                 self.start_triggers(config, channel)
 
     async def on_message(self, message: discord.Message):
-        channel_id = message.channel.id
-        if not message.author.bot and channel_id in self.channel_messages:
-            self.channel_messages[channel_id] -= 1
-            if self.channel_messages[channel_id] <= 0:
-                event = self.channel_events.get(channel_id)
-                if event is not None:
-                    event.set()
+        trigger = self.message_triggers.get(message.channel.id)  # Ran for every message so it's a single lookup
+        if trigger is not None and not message.author.bot:
+            trigger[0] -= 1
+            if trigger[0] <= 0:
+                trigger[1].set()
+
+    async def on_channel_delete(self, channel: discord.Channel):
+        if channel.id in self.channel_loops:  # Releases the waiter and the channel it holds, the config is kept
+            await self.stop_loop(channel.id)
 
     def __unload(self):
         for channel_id in self.channel_loops:
             asyncio.ensure_future(self.stop_loop(channel_id))
+        if self.save_handle is not None:
+            self.flush_data()
 
     # Commands
     @commands.group(pass_context=True, invoke_without_command=True, no_pm=True)
@@ -157,7 +170,6 @@ class Periodic:
             response = self.NOTHING_IN_THAT_CHANNEL
         else:
             response = self.SUCCESSFULLY_DELETED
-            del self.channel_messages[channel.id]
             del self.config[channel.server.id][channel.id]
             await self.stop_loop(channel.id)
             self.save_data()
@@ -216,7 +228,7 @@ class Periodic:
         if config is None:
             response = self.DOESNT_EXIST.format(p=ctx.prefix)
         else:
-            config["messages"].append({"type": "customcommand", "value": command})
+            config["messages"].append({"type": "customcommand", "value": command.lower()})
             self.save_data()
             if len(config["messages"]) == 1:
                 self.start_triggers(config, channel)
@@ -249,18 +261,28 @@ class Periodic:
         else:
             messages = config["messages"]
             current = 0
-            embed = discord.Embed(colour=discord.Colour.light_grey(), title="Processing...")
-            msg = await self.bot.send_message(reply_channel, embed=embed)
-            for e in self.LIST_REACTIONS:
-                asyncio.ensure_future(self.bot.add_reaction(msg, e))
+            embed = discord.Embed(colour=discord.Colour.light_grey())
+            msg = None
+            shown = None  # (current, pages) of the page in msg, to skip edits which wouldn't change anything
+            edit_message = self.bot.edit_message
+            wait_for_reaction = self.bot.wait_for_reaction
+            remove_reaction = self.bot.remove_reaction
             while current >= 0 and len(messages) > 0:
                 pages = len(messages)
                 current %= pages
-                embed.title = self.LIST_TITLE.format(current, pages)
-                embed.description = self.LIST_DESCRIPTION.format(**messages[current])
-                await self.bot.edit_message(msg, embed=embed)
-                r, _ = await self.bot.wait_for_reaction(self.LIST_REACTIONS, user=author, message=msg)
-                asyncio.ensure_future(self.bot.remove_reaction(msg, r.emoji, author))
+                if (current, pages) != shown:
+                    embed.title = self.LIST_TITLE.format(current, pages)
+                    embed.description = self.LIST_DESCRIPTION.format(**messages[current])
+                    if msg is None:  # The first page is sent right away instead of editing a placeholder
+                        msg = await self.bot.send_message(reply_channel, embed=embed)
+                        # Not awaited so the author can react before all of them are added
+                        asyncio.ensure_future(asyncio.gather(*(self.bot.add_reaction(msg, e)
+                                                               for e in self.LIST_REACTIONS)))
+                    else:
+                        await edit_message(msg, embed=embed)
+                    shown = current, pages
+                r, _ = await wait_for_reaction(self.LIST_REACTIONS, user=author, message=msg)
+                asyncio.ensure_future(remove_reaction(msg, r.emoji, author))
                 if r.emoji == self.LIST_PREV_PAGE:
                     current += pages - 1
                 elif r.emoji == self.LIST_NEXT_PAGE:
@@ -271,12 +293,14 @@ class Periodic:
                     confirm_msg = await self.bot.send_message(reply_channel, self.LIST_DELETE_CONFIRM.format(current))
                     asyncio.ensure_future(self.bot.add_reaction(confirm_msg, self.LIST_DELETE_AFFIRM))
                     asyncio.ensure_future(self.bot.add_reaction(confirm_msg, self.LIST_DELETE_CANCEL))
-                    r, _ = await self.bot.wait_for_reaction((self.LIST_DELETE_AFFIRM, self.LIST_DELETE_CANCEL),
-                                                            user=author, message=confirm_msg)
+                    r, _ = await wait_for_reaction((self.LIST_DELETE_AFFIRM, self.LIST_DELETE_CANCEL),
+                                                   user=author, message=confirm_msg)
                     asyncio.ensure_future(self.bot.delete_message(confirm_msg))
                     if r.emoji == self.LIST_DELETE_AFFIRM:
                         asyncio.ensure_future(self.temp_send(reply_channel, self.LIST_DELETED.format(current)))
                         del messages[current]
+                        if current < config.get("cursor", 0):  # Keeps the cursor on the action which was next
+                            config["cursor"] -= 1
                         self.save_data()
                         if len(messages) == 0:
                             await self.stop_loop(channel.id)
@@ -286,18 +310,22 @@ class Periodic:
 
     # Utilities
     async def send_customcom(self, channel: discord.Channel, command_name: str):
-        customcom = self.bot.get_cog("CustomCommands")
-        cmds = customcom.c_commands.get(channel.server.id, {})
-        cmd = cmds.get(command_name) or cmds.get(command_name.lower())
+        cmd = None
+        customcom = self.bot.get_cog("CustomCommands")  # Not kept around since the cog can be reloaded
+        if customcom is not None:
+            cmds = customcom.c_commands.get(channel.server.id)
+            if cmds is not None:
+                # Custom commands are stored lowercased, actions added before periodic did the same need the fallback
+                cmd = cmds.get(command_name) or cmds.get(command_name.lower())
         return cmd and await self.bot.send_message(channel, self.CUSTOMCOM_PREFIX + escape(cmd))
 
     def start_triggers(self, config: dict, channel: discord.Channel):
         event = self.channel_events.get(channel.id) or asyncio.Event()
         triggers = self.channel_triggers.setdefault(channel.id, [])
         if config.get("time_interval", 0) > 0:
-            triggers.append(asyncio.ensure_future(self.call_later(config["time_interval"], event.set)))
+            triggers.append(self.bot.loop.call_later(config["time_interval"], event.set))
         if config.get("message_interval", 0) > 0:
-            self.channel_messages[channel.id] = config["message_interval"]
+            self.message_triggers[channel.id] = [config["message_interval"], event]
         if channel.id not in self.channel_events:
             self.channel_events[channel.id] = event
         else:
@@ -308,12 +336,11 @@ class Periodic:
     def stop_triggers(self, channel_id: str):
         triggers = self.channel_triggers.get(channel_id, [])
         while len(triggers) > 0:
-            task = triggers.pop()
-            if not task.done():
-                task.cancel()
+            triggers.pop().cancel()  # Cancelling a timer which already went off does nothing
 
     async def stop_loop(self, channel_id: str):
         self.stop_triggers(channel_id)
+        self.message_triggers.pop(channel_id, None)
         event = self.channel_events.pop(channel_id, None)
         loop = self.channel_loops.pop(channel_id, None)
         if event is not None:
@@ -324,10 +351,6 @@ class Periodic:
             except asyncio.TimeoutError:
                 self.logger.info("Had to forcefully cancel the waiter for {} when deleting".format(channel_id))
 
-    async def call_later(self, time_to_sleep: float, func):
-        await asyncio.sleep(time_to_sleep)
-        func()
-
     async def temp_send(self, channel: discord.Channel, *args, **kwargs):
         """Sends a message with *args **kwargs in `channel` and deletes it after some time
 
@@ -335,14 +358,15 @@ class Periodic:
         Else it defaults to TEMP_MESSAGE_TIMEOUT"""
         sleep_timeout = kwargs.pop("sleep_timeout", self.TEMP_MESSAGE_TIMEOUT)
         message = await self.bot.send_message(channel, *args, **kwargs)
-        await asyncio.sleep(sleep_timeout)
-        await self.bot.delete_message(message)
+        # A timer is lighter than keeping this coroutine asleep until the deletion
+        self.bot.loop.call_later(sleep_timeout, lambda: asyncio.ensure_future(self.bot.delete_message(message)))
 
     def create_periodic(self, server_id: str, channel_id: str) -> dict:
         return self.config.setdefault(server_id, {}).setdefault(channel_id, {"messages": []})
 
     def get_config(self, server_id: str, channel_id: str) -> dict:
-        return self.config.setdefault(server_id, {}).get(channel_id)
+        server_config = self.config.get(server_id)  # Only create_periodic adds servers to the config
+        return None if server_config is None else server_config.get(channel_id)
 
     # Config
     def check_configs(self):
@@ -369,6 +393,13 @@ class Periodic:
         self.config = dataIO.load_json(self.CONFIG_FILE_PATH)
 
     def save_data(self):
+        if self.save_handle is None:
+            self.save_handle = self.bot.loop.call_later(self.SAVE_DELAY, self.flush_data)
+
+    def flush_data(self):
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
         dataIO.save_json(self.CONFIG_FILE_PATH, self.config)
 
 
@@ -1,5 +1,4 @@
 import asyncio
-import copy
 import discord
 import os.path
 import os
@@ -24,6 +23,7 @@ class ReactRoles:
     # File related constants
     DATA_FOLDER = "data/react_roles"
     CONFIG_FILE_PATH = DATA_FOLDER + "/config.json"
+    SAVE_DELAY = 2  # Seconds, so binding several roles in a row only writes the config once
 
     # Configuration defaults
     SERVER_DEFAULT = {}
@@ -44,6 +44,8 @@ class ReactRoles:
 
     # Behavior related constants
     MAXIMUM_PROCESSED_PER_SECOND = 5
+    ROLE_WORKERS = 4  # Number of members whose roles can be updated at the same time
+    FETCH_CONCURRENCY = 10  # Maximum number of bound messages fetched at the same time when loading
     EMOTE_REGEX = re.compile("<a?:[a-zA-Z0-9_]{2,32}:(\d{1,20})>")
     LINKS_ENTRY = "links"
 
@@ -81,15 +83,19 @@ Gave a total of {g} roles."""
     def __init__(self, bot: discord.Client):
         self.bot = bot
         self.logger = logging.getLogger("red.ZeCogs.react_roles")
+        self.save_handle = None
         self.check_configs()
         self.load_data()
         self.role_queue = asyncio.Queue()
         self.role_map = {}
-        self.role_cache = {}
+        self.updating_members = set()  # Keys of role_map whose member is being updated by a worker
+        self.role_cache = {}  # {(server.id, channel.id, message.id): {emoji.id or str: role}}
+        self.bound_messages = set()  # message.id of the messages in role_cache to quickly ignore the other reactions
+        self.emoji_cache = {}  # {emoji.id: discord.Emoji} of every server's emojis
         self.links = {}  # {server.id: {channel.id_message.id: [role]}}
         self.processing_wait_time = 0 if self.MAXIMUM_PROCESSED_PER_SECOND == 0 else 1/self.MAXIMUM_PROCESSED_PER_SECOND
         asyncio.ensure_future(self._init_bot_manipulation())
-        self.role_processor = asyncio.ensure_future(self.process_role_queue())
+        self.role_processors = [asyncio.ensure_future(self.process_role_queue()) for _ in range(self.ROLE_WORKERS)]
     
     # Events
     async def on_reaction_add(self, reaction, user):
@@ -125,40 +131,68 @@ Gave a total of {g} roles."""
                 for links in server_links.values():
                     if pair in links:
                         links.remove(pair)
+
+    async def on_server_emojis_update(self, before, after):
+        for emoji in before:
+            self.emoji_cache.pop(emoji.id, None)
+        self.emoji_cache.update((e.id, e) for e in after)
+
+    async def on_server_join(self, server):
+        self.emoji_cache.update((e.id, e) for e in server.emojis)
+
+    async def on_server_remove(self, server):
+        for emoji in server.emojis:
+            self.emoji_cache.pop(emoji.id, None)
     
     async def _init_bot_manipulation(self):
         counter = collections.Counter()
         await self.bot.wait_until_ready()
+        self.emoji_cache = {e.id: e for e in itertools.chain.from_iterable(s.emojis for s in self.bot.servers)}
+        servers = []
+        bindings = []  # [(server, channel, message.id, message config)] of every bound message to fetch
         for server_id, server_conf in self.config.items():
             server = self.bot.get_server(server_id)
             if server is not None:
+                servers.append((server, server_conf))
                 for channel_id, channel_conf in filter(lambda o: o[0] != self.LINKS_ENTRY, server_conf.items()):
                     channel = server.get_channel(channel_id)
                     if channel is not None:
-                        for msg_id, msg_conf in channel_conf.items():
-                            msg = await self.safe_get_message(channel, msg_id)
-                            if msg is not None:
-                                self.add_cache_message(msg)  # This is where the magic happens.
-                                for emoji_str, role_id in msg_conf.items():
-                                    role = discord.utils.get(server.roles, id=role_id)
-                                    if role is not None:
-                                        self.add_to_cache(server_id, channel_id, msg_id, emoji_str, role)
-                                        counter.update((channel.name, ))
-                            else:
-                                self.logger.warning("Could not find message {} in {}".format(msg_id, channel.mention))
+                        bindings.extend((server, channel, msg_id, conf) for msg_id, conf in channel_conf.items())
                     else:
                         self.logger.warning("Could not find channel with id {} in server {}".format(channel_id,
                                                                                                     server.name))
-                link_list = server_conf.get(self.LINKS_ENTRY)
-                if link_list is not None:
-                    self.parse_links(server_id, link_list.values())
             else:
                 self.logger.warning("Could not find server with id {}".format(server_id))
+
+        semaphore = asyncio.Semaphore(self.FETCH_CONCURRENCY)
+
+        async def fetch_one(channel, msg_id):
+            async with semaphore:
+                return await self.safe_get_message(channel, msg_id)
+        messages = await asyncio.gather(*(fetch_one(b[1], b[2]) for b in bindings))
+
+        for (server, channel, msg_id, msg_conf), msg in zip(bindings, messages):
+            if msg is not None:
+                self.add_cache_message(msg)  # This is where the magic happens.
+                for emoji_str, role_id in msg_conf.items():
+                    role = discord.utils.get(server.roles, id=role_id)
+                    if role is not None:
+                        self.add_to_cache(server.id, channel.id, msg_id, emoji_str, role)
+                        counter.update((channel.name, ))
+            else:
+                self.logger.warning("Could not find message {} in {}".format(msg_id, channel.mention))
+        for server, server_conf in servers:  # The links need the roles of every message to be cached
+            link_list = server_conf.get(self.LINKS_ENTRY)
+            if link_list is not None:
+                self.parse_links(server.id, link_list.values())
         self.logger.info("Cached bindings: {}".format(", ".join(": ".join(map(str, pair)) for pair in counter.items())))
 
     def __unload(self):
         # This method is ran whenever the bot unloads this cog.
-        self.role_processor.cancel()
+        for processor in self.role_processors:
+            processor.cancel()
+        if self.save_handle is not None:
+            self.flush_data()
     
     # Commands
     @commands.group(name="roles", pass_context=True, no_pm=True, invoke_without_command=True)
@@ -287,10 +321,7 @@ Gave a total of {g} roles."""
                 elif channel.permissions_for(channel.server.me).add_reactions is False:
                     response = self.CANT_ADD_REACTIONS
                 else:
-                    emoji = None
-                    for emoji_server in self.bot.servers:
-                        if emoji is None:
-                            emoji = discord.utils.get(emoji_server.emojis, id=emoji_id)
+                    emoji = self.emoji_cache.get(emoji_id)
                     try:
                         await self.bot.add_reaction(message, emoji or emoji_id)
                     except discord.HTTPException:  # Failed to find the emoji
@@ -338,12 +369,12 @@ Gave a total of {g} roles."""
                     lambda r: r.emoji.id == emoji_str if r.custom_emoji else r.emoji == emoji_str, msg.reactions)
                 after = None
                 count = 0
-                user = None
                 for page in range(math.ceil(reaction.count / 100)):
-                    for user in await self.bot.get_reaction_users(reaction, after=after):
-                        await self.bot.remove_reaction(msg, reaction.emoji, user)
-                        count += 1
-                    after = user
+                    users = await self.bot.get_reaction_users(reaction, after=after)
+                    await self.gather_limited(self.bot.remove_reaction(msg, reaction.emoji, u) for u in users)
+                    count += len(users)
+                    if len(users) > 0:
+                        after = users[-1]
                     await self.bot.edit_message(answer, self.PROGRESS_REMOVED.format(count, reaction.count))
                 await self.bot.edit_message(answer, self.REACTION_CLEAN_DONE.format(count))
     
@@ -374,17 +405,17 @@ Gave a total of {g} roles."""
                     if role is not None:
                         before = 0
                         after = None
-                        user = None
                         while before != after:
                             before = after
-                            for user in await self.bot.get_reaction_users(react, after=after):
-                                member = server.get_member(user.id)
-                                if member is not None and member != self.bot.user and \
-                                        discord.utils.get(member.roles, id=role.id) is None:
-                                    await self.bot.add_roles(member, role)
-                                    given_roles += 1
-                                checked_count += 1
-                            after = user
+                            users = await self.bot.get_reaction_users(react, after=after)
+                            members = (server.get_member(user.id) for user in users)
+                            missing = [m for m in members if m is not None and m != self.bot.user and
+                                       discord.utils.get(m.roles, id=role.id) is None]
+                            await self.gather_limited(self.bot.add_roles(member, role) for member in missing)
+                            given_roles += len(missing)
+                            checked_count += len(users)
+                            if len(users) > 0:
+                                after = users[-1]
                             await self.bot.edit_message(progress_msg, self.PROGRESS_FORMAT.format(
                                                             c=checked_count, r=total_count, t=total_reactions))
                     else:
@@ -398,7 +429,7 @@ Gave a total of {g} roles."""
     async def check_add_role(self, reaction, member):
         message = reaction.message
         channel = message.channel
-        if isinstance(member, discord.Member) and member != self.bot.user:
+        if message.id in self.bound_messages and isinstance(member, discord.Member) and member != self.bot.user:
             # Check whether or not the reaction happened on a server and prevent the bot from giving itself the role
             server = channel.server
             emoji_str = reaction.emoji.id if reaction.custom_emoji else reaction.emoji
@@ -410,7 +441,8 @@ Gave a total of {g} roles."""
     async def check_remove_role(self, reaction, member):
         message = reaction.message
         channel = message.channel
-        if isinstance(member, discord.Member):  # Check whether or not the reaction happened on a server
+        # Check whether or not the reaction happened on a server
+        if message.id in self.bound_messages and isinstance(member, discord.Member):
             server = channel.server
             emoji_str = reaction.emoji.id if reaction.custom_emoji else reaction.emoji
             if member == self.bot.user:  # Safeguard in case a mod removes the bot's reaction by accident
@@ -423,7 +455,7 @@ Gave a total of {g} roles."""
                     await self.add_role_queue(member, role, False)
     
     async def add_role_queue(self, member, role, add_bool, *, linked_roles=set()):
-        key = "_".join((member.server.id, member.id))  # Doing it this way here to make it simpler a bit
+        key = member.server.id, member.id  # Tuples hash without building a new string
         q = self.role_map.get(key)
         if q is None:  # True --> add   False --> remove
             q = {True: set(), False: {member.server.default_role}, "mem": member}
@@ -431,8 +463,8 @@ Gave a total of {g} roles."""
             await self.role_queue.put(key)
         q[True].difference_update(linked_roles)  # Remove the linked roles from the roles to add
         q[False].update(linked_roles)  # Add the linked roles to remove them if the user has any of them
-        q[not add_bool] -= {role}
-        q[add_bool] |= {role}
+        q[not add_bool].discard(role)
+        q[add_bool].add(role)
         self.role_map[key] = q
 
     async def process_role_queue(self):  # This exists to update multiple roles at once when possible
@@ -441,24 +473,40 @@ Gave a total of {g} roles."""
         with contextlib.suppress(RuntimeError, asyncio.CancelledError):  # Suppress the "Event loop is closed" error
             while self == self.bot.get_cog(self.__class__.__name__):
                 key = await self.role_queue.get()
-                q = self.role_map.pop(key)
-                if q is not None and q.get("mem") is not None:
-                    mem = q["mem"]
-                    all_roles = set(mem.roles)
-                    add_set = q.get(True, set())
-                    del_set = q.get(False, {mem.server.default_role})
-                    try:
-                        await self.bot.replace_roles(mem, *((all_roles | add_set) - del_set))
-                        # Basically, the user's roles + the added - the removed
-                    except (discord.Forbidden, discord.HTTPException):
-                        self.role_map[key] = q  # Try again when it fails
-                        await self.role_queue.put(key)
-                    else:
-                        self.role_queue.task_done()
-                    finally:
-                        await asyncio.sleep(self.processing_wait_time)
+                if key in self.updating_members:  # Updates of a member are done one at a time, it's retried later
+                    await self.role_queue.put(key)
+                else:
+                    q = self.role_map.pop(key, None)  # A failed update can queue a key which was already queued
+                    if q is not None and q.get("mem") is not None:
+                        mem = q["mem"]
+                        all_roles = set(mem.roles)
+                        add_set = q.get(True, set())
+                        del_set = q.get(False, {mem.server.default_role})
+                        self.updating_members.add(key)
+                        try:
+                            await self.bot.replace_roles(mem, *((all_roles | add_set) - del_set))
+                            # Basically, the user's roles + the added - the removed
+                        except (discord.Forbidden, discord.HTTPException):
+                            self.role_map[key] = q  # Try again when it fails
+                            await self.role_queue.put(key)
+                        else:
+                            self.role_queue.task_done()
+                        finally:
+                            self.updating_members.discard(key)
+                # Paced after the update so an idle worker serves the next reaction right away
+                # Every worker waits for its share so the total rate stays at MAXIMUM_PROCESSED_PER_SECOND
+                await asyncio.sleep(self.processing_wait_time * self.ROLE_WORKERS)
         self.logger.debug("The processing loop has ended.")
 
+    async def gather_limited(self, coros):
+        """Runs the coroutines concurrently with at most MAXIMUM_PROCESSED_PER_SECOND of them at a time"""
+        semaphore = asyncio.Semaphore(max(1, self.MAXIMUM_PROCESSED_PER_SECOND))
+
+        async def run(coro):
+            async with semaphore:
+                return await coro
+        return await asyncio.gather(*(run(c) for c in coros))
+
     async def safe_get_message(self, channel, message_id):
         try:
             result = await self.bot.get_message(channel, message_id)
@@ -497,36 +545,32 @@ Gave a total of {g} roles."""
     # Cache -- Needed to keep the actual role object in cache instead of looking for it every time in the server's roles
     def add_to_cache(self, server_id, channel_id, message_id, emoji_str, role):
         """Adds an entry to the role cache"""
-        server_conf = self.role_cache.setdefault(server_id, {})
-        channel_conf = server_conf.setdefault(channel_id, {})
-        message_conf = channel_conf.setdefault(message_id, {})
-        message_conf[emoji_str] = role
+        self.role_cache.setdefault((server_id, channel_id, message_id), {})[emoji_str] = role
+        self.bound_messages.add(message_id)
 
     def get_all_roles_from_message(self, server_id, channel_id, message_id):
         """Fetches all roles from a given message returns an iterable"""
-        return self.role_cache.get(server_id, {}).get(channel_id, {}).get(message_id, {}).values()
+        message_conf = self.role_cache.get((server_id, channel_id, message_id))
+        return () if message_conf is None else message_conf.values()
 
     def get_from_cache(self, server_id, channel_id, message_id, emoji_str):
         """Fetches the role associated with an emoji on the given message"""
-        return self.role_cache.get(server_id, {}).get(channel_id, {}).get(message_id, {}).get(emoji_str)
+        message_conf = self.role_cache.get((server_id, channel_id, message_id))
+        return None if message_conf is None else message_conf.get(emoji_str)
 
     def remove_role_from_cache(self, server_id, channel_id, message_id, emoji_str):
         """Removes an entry from the role cache"""
-        server_conf = self.role_cache.get(server_id)
-        if server_conf is not None:
-            channel_conf = server_conf.get(channel_id)
-            if channel_conf is not None:
-                message_conf = channel_conf.get(message_id)
-                if message_conf is not None and emoji_str in message_conf:
-                    del message_conf[emoji_str]
+        message_conf = self.role_cache.get((server_id, channel_id, message_id))
+        if message_conf is not None and emoji_str in message_conf:
+            del message_conf[emoji_str]
+            if len(message_conf) == 0:
+                del self.role_cache[(server_id, channel_id, message_id)]
+                self.bound_messages.discard(message_id)
 
     def remove_message_from_cache(self, server_id, channel_id, message_id):
         """Removes a message from the role cache"""
-        server_conf = self.role_cache.get(server_id)
-        if server_conf is not None:
-            channel_conf = server_conf.get(channel_id)
-            if channel_conf is not None and message_id in channel_conf:
-                del channel_conf[message_id]
+        self.role_cache.pop((server_id, channel_id, message_id), None)
+        self.bound_messages.discard(message_id)
 
     # Client Modification Proxy
     def add_cache_message(self, message):
@@ -546,8 +590,8 @@ Gave a total of {g} roles."""
     def get_config(self, server_id):
         config = self.config.get(server_id)
         if config is None:
-            self.config[server_id] = copy.deepcopy(self.SERVER_DEFAULT)
-        return self.config.get(server_id)
+            config = self.config[server_id] = dict(self.SERVER_DEFAULT)  # The default is empty so no deep copy
+        return config
     
     def check_configs(self):
         self.check_folders()
@@ -570,6 +614,13 @@ Gave a total of {g} roles."""
         self.config = dataIO.load_json(self.CONFIG_FILE_PATH)
     
     def save_data(self):
+        if self.save_handle is None:
+            self.save_handle = self.bot.loop.call_later(self.SAVE_DELAY, self.flush_data)
+    
+    def flush_data(self):
+        if self.save_handle is not None:
+            self.save_handle.cancel()
+            self.save_handle = None
         dataIO.save_json(self.CONFIG_FILE_PATH, self.config)
 
 